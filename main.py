@@ -1,17 +1,24 @@
 # main.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import os
 import logging
 import json
+import time
+import asyncio
 from enum import Enum
 
 # Import des services
 from services.model_service import ModelService
 from services.prompt_service import PromptService
 from services.localisation_service import LocationService
+from services.followup_cache import SpeculativeFollowupStore
+from services.serialization import parse_ticket, api_response
+from services.metrics import metrics
+from services.health_service import HealthService
 from models.schemas import TicketInput, FollowUpInput, ApiResponse, HistoryMessage
 
 # Configuration du logging
@@ -30,6 +37,14 @@ class Config:
     CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:5173").split(",")
     OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
     OLLAMA_MODEL_NAME = os.getenv("OLLAMA_MODEL_NAME", "mistral:instruct")
+    SPECULATIVE_FOLLOWUP = os.getenv("SPECULATIVE_FOLLOWUP", "false").lower() in ("1", "true", "yes")
+    SPECULATIVE_FOLLOWUP_TTL = float(os.getenv("SPECULATIVE_FOLLOWUP_TTL", "120"))
+    DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+    HEALTH_REFRESH_INTERVAL = float(os.getenv("HEALTH_REFRESH_INTERVAL", "15"))
+    READINESS_MAX_IN_FLIGHT = int(os.getenv("READINESS_MAX_IN_FLIGHT", "50"))
+    TICKET_INDEX = os.getenv("TICKET_INDEX", "false").lower() in ("1", "true", "yes")
+    TICKET_INDEX_DIR = os.getenv("TICKET_INDEX_DIR", "data/ticket_index")
+    TICKET_INDEX_FEWSHOT_THRESHOLD = float(os.getenv("TICKET_INDEX_FEWSHOT_THRESHOLD", "0.6"))
     
     @classmethod
     def validate(cls):
@@ -49,7 +64,8 @@ class ModelBackend(str, Enum):
 app = FastAPI(
     title="Support Ticket AI Assistant",
     description="API pour l'analyse et le suivi des tickets de support",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Configuration CORS
@@ -65,54 +81,150 @@ app.add_middleware(
 prompt_service = PromptService()
 model_service = None
 localisation_service = None
+followup_store = SpeculativeFollowupStore(ttl=Config.SPECULATIVE_FOLLOWUP_TTL)
+health_service = HealthService(refresh_interval=Config.HEALTH_REFRESH_INTERVAL)
+# Nombre de générations en cours (profondeur de file pour la readiness)
+in_flight_generations = 0
 
 @app.on_event("startup")
 async def startup_event():
     """Vérifications et initialisation au démarrage"""
     global model_service, localisation_service
+    started_at = time.perf_counter()
     
     try:
         # Validation de la configuration
         Config.validate()
         
+        # Index des tickets déjà analysés (import tardif : numpy n'est chargé que s'il est activé)
+        ticket_index = None
+        if Config.TICKET_INDEX:
+            from services.ticket_index import TicketIndex
+            ticket_index = TicketIndex(
+                Config.TICKET_INDEX_DIR,
+                fewshot_threshold=Config.TICKET_INDEX_FEWSHOT_THRESHOLD
+            )
+
         # Initialisation du service de modèle
         model_service = ModelService(
             Config.MODEL_BACKEND, 
             Config.OLLAMA_URL, 
             Config.OLLAMA_MODEL_NAME,
-            prompt_service
+            prompt_service,
+            ticket_index=ticket_index
         )
 
         localisation_service = LocationService()
         
         logger.info(f"Application démarrée avec le backend: {Config.MODEL_BACKEND}")
         
-        # Test de chargement des prompts
+        # Vérification du registre des prompts (chargé à l'initialisation)
         try:
-            prompt_service.get_system_prompt()
-            prompt_service.get_followup_system_prompt()
-            prompt_service.get_minimal_system_prompt()
+            prompt_service.get_template("base_prompt")
+            prompt_service.get_template("followup_prompt")
+            prompt_service.get_template("minimal_prompt")
             logger.info("Tous les prompts ont été chargés avec succès")
+            logger.info(f"Initialisation terminée en {(time.perf_counter() - started_at) * 1000:.0f} ms")
         except Exception as e:
             logger.error(f"Erreur lors du chargement des prompts: {str(e)}")
             raise
+
+        # Vérifications de readiness rafraîchies en tâche de fond, jamais pendant une probe
+        health_service.register("backend", model_service.check_backend)
+        health_service.register("prompts", check_prompts)
+        health_service.register("rate_limit", model_service.rate_limit_status, critical=False)
+        health_service.register("locations", localisation_service.get_status, critical=False)
+        health_service.start()
             
     except Exception as e:
         logger.error(f"Erreur lors du démarrage: {str(e)}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Arrêt de la tâche de vérification de santé"""
+    await health_service.stop()
+
+def check_prompts() -> dict:
+    """Présence des prompts requis dans le registre"""
+    prompts = {
+        name: prompt_service.is_loaded(name)
+        for name in ("base_prompt", "followup_prompt", "followup_user", "minimal_prompt")
+    }
+    return {"ok": all(prompts.values()), **prompts}
+
+def queue_status() -> dict:
+    """Générations en cours comparées au seuil de readiness (lecture en mémoire)"""
+    return {
+        "ok": in_flight_generations < Config.READINESS_MAX_IN_FLIGHT,
+        "in_flight": in_flight_generations,
+        "max_in_flight": Config.READINESS_MAX_IN_FLIGHT
+    }
+
+async def run_until_disconnected(request: Request, coro, endpoint: str):
+    """
+    Attend le résultat de `coro` en surveillant la connexion du client.
+
+    Si le client se déconnecte, la tâche est annulée : l'annulation remonte
+    jusqu'à l'appel HTTP au modèle et interrompt les retries en attente.
+    """
+    global in_flight_generations
+    task = asyncio.create_task(coro)
+    in_flight_generations += 1
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=Config.DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                metrics.increment("client_disconnected", endpoint)
+                logger.info(f"Client déconnecté pendant {endpoint}, annulation de la génération")
+                raise HTTPException(status_code=499, detail="Client déconnecté")
+    finally:
+        in_flight_generations -= 1
+        if not task.done():
+            task.cancel()
+
+def readiness() -> dict:
+    """Dernier instantané des vérifications, complété par la file en mémoire et son ancienneté"""
+    snapshot = health_service.snapshot()
+    queue = queue_status()
+    freshness = health_service.freshness()
+    snapshot["checks"] = {
+        **snapshot["checks"],
+        "queue": {**queue, "critical": True},
+        "freshness": {**freshness, "critical": True}
+    }
+    snapshot["ready"] = bool(model_service) and snapshot["ready"] and queue["ok"] and freshness["ok"]
+    return snapshot
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness : le processus répond, sans aucune vérification externe"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness : lit l'état mis en cache par la tâche de fond (503 si non prêt)"""
+    status = readiness()
+    return ORJSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 @app.get("/health")
 async def health_check():
     """Endpoint de santé détaillé"""
     try:
+        ready = readiness()
         status = {
-            "status": "healthy",
+            "status": "healthy" if ready["ready"] else "unhealthy",
             "backend": Config.MODEL_BACKEND,
+            "checks": ready["checks"],
+            "checks_age_seconds": ready["age_seconds"],
             "model_service": model_service.get_status() if model_service else None,
+            "speculative_followup": followup_store.get_status() if Config.SPECULATIVE_FOLLOWUP else None,
             "prompts": {
-                "base_prompt": bool(prompt_service._cache.get("base_prompt") or True),
-                "followup_prompt": bool(prompt_service._cache.get("followup_prompt") or True),
-                "minimal_prompt": bool(prompt_service._cache.get("minimal_prompt") or True)
+                "base_prompt": prompt_service.is_loaded("base_prompt"),
+                "followup_prompt": prompt_service.is_loaded("followup_prompt"),
+                "minimal_prompt": prompt_service.is_loaded("minimal_prompt")
             }
         }
         return status
@@ -121,7 +233,7 @@ async def health_check():
         return {"status": "unhealthy", "error": str(e)}
 
 @app.post("/analyze", response_model=ApiResponse)
-async def analyze_ticket(ticket: TicketInput) -> ApiResponse:
+async def analyze_ticket(ticket: TicketInput, request: Request) -> ORJSONResponse:
     """
     Analyse un message de support et génère un ticket structuré
     """
@@ -132,37 +244,54 @@ async def analyze_ticket(ticket: TicketInput) -> ApiResponse:
         logger.info(f"Analyse du ticket: {ticket.message[:50]}...")
         
         # Le ticket.history est maintenant une liste d'objets HistoryMessage
-        result_str = await model_service.analyze_ticket(ticket.message, ticket.history)
+        result_str = await run_until_disconnected(
+            request, model_service.analyze_ticket(ticket.message, ticket.history), "analyze"
+        )
 
         logger.info(f"Réponse du modèle: {result_str}...")
 
         parsed_result = {}
         try:
             if result_str:
-                parsed_result = json.loads(result_str)
+                # Parsing et validation TicketResponse en une seule passe
+                parsed_result = parse_ticket(result_str)
             else:
                 raise json.JSONDecodeError("La réponse du modèle est vide", "", 0)
         except json.JSONDecodeError as e:
             logger.warning(f"JSON invalide reçu du modèle: {str(e)}")
-            # MODIFIÉ : Retourner une instance de ApiResponse en cas d'erreur
-            return ApiResponse(
+            return api_response(
                 success=False,
                 data=result_str,
                 message="Le modèle a retourné une réponse invalide ou vide.",
                 error=str(e)
             )
 
-        if 'localisation' in parsed_result and parsed_result['localisation']:
-            user_location = parsed_result['localisation']
-            normalized_location = localisation_service.find_best_match(user_location)
-            if normalized_location:
-                parsed_result['localisation'] = normalized_location
+        # Le modèle produit "Localisation" ; l'ancienne clé en minuscules reste acceptée
+        if isinstance(parsed_result, dict):
+            for key in ("Localisation", "localisation"):
+                if parsed_result.get(key):
+                    normalized_location = localisation_service.find_best_match(parsed_result[key])
+                    if normalized_location:
+                        parsed_result[key] = normalized_location
 
-        # MODIFIÉ : Retourner une instance de ApiResponse en cas de succès
-        return ApiResponse(
+            await model_service.remember_analysis(ticket.message, ticket.history, parsed_result)
+
+        # Mode spéculatif : la question de suivi est générée pendant que le client traite la réponse
+        followup_token = None
+        if Config.SPECULATIVE_FOLLOWUP and isinstance(parsed_result, dict) and parsed_result:
+            followup_history = list(ticket.history or []) + [HistoryMessage(role="user", content=ticket.message)]
+            followup_prompt = prompt_service.build_followup_prompt(parsed_result, followup_history)
+            followup_token = followup_store.start(
+                parsed_result,
+                followup_history,
+                lambda: model_service.generate_followup(followup_prompt, followup_history)
+            )
+
+        return api_response(
             success=True,
             data=parsed_result,
-            message="Ticket analysé avec succès"
+            message="Ticket analysé avec succès",
+            followup_token=followup_token
         )
     except HTTPException:
         raise
@@ -173,7 +302,7 @@ async def analyze_ticket(ticket: TicketInput) -> ApiResponse:
 
 # MODIFIÉ : Le response_model est maintenant ApiResponse
 @app.post("/followup", response_model=ApiResponse)
-async def generate_followup(data: FollowUpInput) -> ApiResponse:
+async def generate_followup(data: FollowUpInput, request: Request) -> ORJSONResponse:
     """
     Génère une question de suivi basée sur un ticket partiellement rempli
     """
@@ -184,17 +313,20 @@ async def generate_followup(data: FollowUpInput) -> ApiResponse:
     try:
         logger.info("Génération d'une question de suivi")
         
-        if not data.ticket:
-            raise HTTPException(status_code=400, detail="Le ticket ne peut pas être vide")
-        
-        prompt = prompt_service.build_followup_prompt(data.ticket, data.history)
-        # Note: data.history est maintenant une liste d'objets
-        result = await model_service.generate_followup(prompt, data.history)
+        # Question déjà générée par anticipation lors de /analyze ?
+        result = await run_until_disconnected(
+            request, followup_store.take(data.followup_token, data.ticket, data.history), "followup"
+        )
+        if result is None:
+            prompt = prompt_service.build_followup_prompt(data.ticket, data.history)
+            # Note: data.history est maintenant une liste d'objets
+            result = await run_until_disconnected(
+                request, model_service.generate_followup(prompt, data.history), "followup"
+            )
         
         logger.info(f"Réponse du modèle: {result}...")
 
-        # MODIFIÉ : Retourner une instance de ApiResponse
-        return ApiResponse(
+        return api_response(
             success=True,
             data={"question": result},
             message="Question de suivi générée avec succès"
@@ -203,8 +335,7 @@ async def generate_followup(data: FollowUpInput) -> ApiResponse:
         raise
     except Exception as e:
         logger.error(f"Erreur lors de la génération: {str(e)}")
-        # MODIFIÉ : Retourner une instance de ApiResponse en cas d'erreur
-        return ApiResponse(
+        return api_response(
             success=False,
             message="Erreur interne lors de la génération de la question.",
             error=str(e)
@@ -214,15 +345,13 @@ async def generate_followup(data: FollowUpInput) -> ApiResponse:
 async def reload_prompts():
     """Endpoint pour recharger les prompts (utile en développement)"""
     try:
-        prompt_service.invalidate_cache()
-        # Test de rechargement
-        prompt_service.get_system_prompt()
-        prompt_service.get_followup_system_prompt()
-        prompt_service.get_minimal_system_prompt()
+        # Le registre n'est remplacé que si tous les fichiers ont été relus
+        prompt_service.reload()
         
         return {
             "success": True,
-            "message": "Prompts rechargés avec succès"
+            "message": "Prompts rechargés avec succès",
+            "prompts": prompt_service.describe()
         }
     except Exception as e:
         logger.error(f"Erreur lors du rechargement des prompts: {str(e)}")
@@ -231,6 +360,23 @@ async def reload_prompts():
             detail=f"Erreur lors du rechargement: {str(e)}"
         )
 
+@app.get("/admin/metrics")
+async def get_metrics():
+    """Compteurs applicatifs (déconnexions clients, appels annulés...)"""
+    return metrics.snapshot()
+
+@app.get("/admin/usage")
+async def token_usage():
+    """Consommation de tokens par endpoint et par modèle, budgets et plafonds adaptés"""
+    if not model_service:
+        raise HTTPException(status_code=500, detail="Service non initialisé")
+    return model_service.usage.get_status()
+
+@app.get("/admin/prompts")
+async def list_prompts():
+    """Liste les prompts chargés avec leur version, hash et nombre de tokens"""
+    return prompt_service.describe()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
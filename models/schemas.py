@@ -1,8 +1,11 @@
 # models/schemas.py
 from pydantic import BaseModel, Field, field_validator, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union, Literal, Annotated
 from enum import Enum
 
+# Valeur que les prompts demandent au modèle pour toute information manquante
+Unknown = Literal["[INCONNU]"]
+
 class TicketCategory(str, Enum):
     """Catégories de tickets disponibles"""
     BUG = "BUG"
@@ -33,8 +36,6 @@ class TicketInput(BaseModel):
         description="Historique structuré des messages précédents"
     )
     
-    # --- MODIFIÉ : Syntaxe du validateur ---
-    # @validator devient @field_validator
     @field_validator('message')
     @classmethod
     def validate_message(cls, v: str) -> str:
@@ -63,6 +64,10 @@ class FollowUpInput(BaseModel):
         default_factory=list,
         description="Historique structuré de la conversation"
     )
+    followup_token: Optional[str] = Field(
+        default=None,
+        description="Jeton renvoyé par /analyze pour récupérer la question anticipée"
+    )
     
     @field_validator('ticket')
     @classmethod
@@ -91,22 +96,29 @@ class FollowUpInput(BaseModel):
 
 class TicketResponse(BaseModel):
     """Schéma pour la réponse d'un ticket analysé"""
-    title: str = Field(..., description="Titre du ticket")
-    category: TicketCategory = Field(..., description="Catégorie du ticket")
-    priority: TicketPriority = Field(..., description="Priorité du ticket")
-    localisation: str = Field(..., description="Localisation ou [INCONNU]")
-    description: str = Field(..., description="Description du problème")
-    frustration: int = Field(..., ge=1, le=5, description="Niveau de frustration (1-5)")
+    # Les alias correspondent aux clés produites par le modèle (voir prompts/base_prompt.txt)
+    title: str = Field(..., alias="Title", description="Titre du ticket")
+    # [INCONNU] est la sortie normale tant qu'une information manque (premier tour)
+    category: Union[TicketCategory, Unknown] = Field(..., alias="Category", description="Catégorie du ticket ou [INCONNU]")
+    priority: Union[TicketPriority, Unknown] = Field(..., alias="Priority", description="Priorité du ticket ou [INCONNU]")
+    localisation: str = Field(..., alias="Localisation", description="Localisation ou [INCONNU]")
+    description: str = Field(..., alias="Description", description="Description du problème")
+    frustration: Union[Annotated[int, Field(ge=1, le=5)], Unknown] = Field(
+        ..., alias="Frustration", description="Niveau de frustration (1-5) ou [INCONNU]"
+    )
     
+    # Les champs supplémentaires (Service TAG, Code FR...) sont conservés tels quels
     model_config = ConfigDict(
+        populate_by_name=True,
+        extra="allow",
         json_schema_extra = {
             "example": {
-                "title": "Problème d'impression",
-                "category": "INCIDENT",
-                "priority": "MOYENNE",
-                "localisation": "Bureau 204",
-                "description": "L'imprimante HP du bureau ne répond plus depuis ce matin",
-                "frustration": 3
+                "Title": "Problème d'impression",
+                "Category": "INCIDENT",
+                "Priority": "MOYENNE",
+                "Localisation": "Bureau 204",
+                "Description": "L'imprimante HP du bureau ne répond plus depuis ce matin",
+                "Frustration": 3
             }
         }
     )
@@ -117,6 +129,10 @@ class ApiResponse(BaseModel):
     data: Optional[Any] = Field(default=None, description="Données de la réponse")
     message: str = Field(..., description="Message descriptif")
     error: Optional[str] = Field(default=None, description="Message d'erreur si applicable")
+    followup_token: Optional[str] = Field(
+        default=None,
+        description="Jeton de la question de suivi anticipée (mode spéculatif)"
+    )
     
     model_config = ConfigDict(
         json_schema_extra = {
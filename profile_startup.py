@@ -0,0 +1,90 @@
+# profile_startup.py
+"""
+Profil de démarrage de l'API.
+
+Usage:
+    python profile_startup.py            # temps de démarrage + modules les plus coûteux
+    python profile_startup.py --top 30
+
+Mesure dans un processus neuf l'import de `main` puis l'événement de startup
+(chargement des prompts, du backend configuré et des localisations), et
+retourne un code de sortie non nul si le budget STARTUP_BUDGET_MS est dépassé.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUDGET_MS = 2000
+
+_TIMING_SNIPPET = """
+import asyncio, json, logging, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+logging.disable(logging.CRITICAL)
+asyncio.run(main.startup_event())
+ready = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "startup_ms": (ready - imported) * 1000}))
+"""
+
+
+def measure_startup() -> dict:
+    """Temps d'import de main et d'exécution du startup, dans un processus neuf"""
+    output = subprocess.run(
+        [sys.executable, "-c", _TIMING_SNIPPET],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["total_ms"] = timings["import_ms"] + timings["startup_ms"]
+    return timings
+
+
+def profile_imports(top: int = 15) -> list:
+    """Modules les plus coûteux à l'import (python -X importtime), triés par temps propre"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+    ).stderr
+
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+    modules.sort(reverse=True)
+    return modules[:top]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Profil de démarrage de l'API")
+    parser.add_argument("--top", type=int, default=15, help="Nombre de modules à afficher")
+    parser.add_argument(
+        "--budget-ms", type=float,
+        default=float(os.getenv("STARTUP_BUDGET_MS", DEFAULT_BUDGET_MS)),
+        help="Budget de démarrage (import + startup) en millisecondes"
+    )
+    args = parser.parse_args()
+
+    print(f"Modules les plus coûteux (backend: {os.getenv('MODEL_BACKEND', 'mistral')})")
+    for self_us, cumulative_us, name in profile_imports(args.top):
+        print(f"  {self_us / 1000:8.1f} ms  (cumulé {cumulative_us / 1000:8.1f} ms)  {name}")
+
+    timings = measure_startup()
+    print(
+        f"Import: {timings['import_ms']:.0f} ms, startup: {timings['startup_ms']:.0f} ms, "
+        f"total: {timings['total_ms']:.0f} ms (budget: {args.budget_ms:.0f} ms)"
+    )
+
+    if timings["total_ms"] > args.budget_ms:
+        print("❌ Budget de démarrage dépassé")
+        return 1
+    print("✅ Budget de démarrage respecté")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# services/followup_cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def ticket_fingerprint(ticket: Dict[str, Any], history: Optional[List[Any]] = None) -> str:
+    """Empreinte stable d'un ticket et de l'historique (role, content), indépendante de l'ordre des clés"""
+    turns = [(msg.role, msg.content) for msg in history or []]
+    canonical = json.dumps([ticket, turns], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SpeculativeFollowupStore:
+    """
+    Stocke les questions de suivi générées par anticipation pendant /analyze.
+
+    Chaque génération est lancée en tâche de fond et indexée par un jeton court
+    renvoyé au client ; un appel /followup ultérieur sur le même ticket récupère
+    le résultat sans nouvel appel au modèle, à condition que le ticket et
+    l'historique soient identiques à ceux utilisés pour la génération.
+    """
+
+    def __init__(self, ttl: float = 120.0, max_entries: int = 1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, str, asyncio.Task]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, ticket: Dict[str, Any], history: Optional[List[Any]],
+              factory: Callable[[], Awaitable[str]]) -> str:
+        """Lance la génération anticipée et retourne le jeton associé"""
+        self._purge()
+        if len(self._entries) >= self.max_entries:
+            oldest = min(self._entries, key=lambda t: self._entries[t][0])
+            self._discard(oldest)
+
+        task = asyncio.create_task(factory())
+        task.add_done_callback(self._consume_exception)
+
+        token = secrets.token_urlsafe(16)
+        self._entries[token] = (time.monotonic() + self.ttl, ticket_fingerprint(ticket, history), task)
+        return token
+
+    async def take(self, token: Optional[str], ticket: Dict[str, Any],
+                   history: Optional[List[Any]] = None) -> Optional[str]:
+        """
+        Retourne la question anticipée pour ce jeton si le ticket et l'historique sont identiques.
+
+        Retourne None (et l'appelant génère normalement) si le jeton est inconnu,
+        expiré, associé à un autre ticket ou historique, ou si la génération a échoué.
+        """
+        if not token:
+            return None
+        self._purge()
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        _, fingerprint, task = entry
+        if fingerprint != ticket_fingerprint(ticket, history):
+            task.cancel()
+            self.misses += 1
+            logger.info("Ticket ou historique modifié depuis l'analyse, question anticipée ignorée")
+            return None
+
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                self.misses += 1
+                return None
+            # Client déconnecté : la génération n'a plus de destinataire
+            task.cancel()
+            raise
+        except Exception as e:
+            self.misses += 1
+            logger.warning(f"Échec de la génération anticipée: {str(e)}")
+            return None
+
+        self.hits += 1
+        return result
+
+    def _purge(self):
+        """Supprime les entrées expirées et annule les générations encore en cours"""
+        now = time.monotonic()
+        for token in [t for t, (expires_at, _, _) in self._entries.items() if expires_at <= now]:
+            self._discard(token)
+
+    def _discard(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is not None and not entry[2].done():
+            entry[2].cancel()
+            metrics.increment("speculative_cancelled")
+
+    @staticmethod
+    def _consume_exception(task: asyncio.Task):
+        # Évite les avertissements "Task exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,100 @@
+# services/health_service.py
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+Check = Callable[[], Union[Dict[str, Any], Awaitable[Dict[str, Any]]]]
+
+
+class HealthService:
+    """
+    Vérifications de disponibilité exécutées en tâche de fond.
+
+    Les probes (/health/ready) ne lisent que le dernier instantané : elles
+    n'ajoutent ni appel amont ni latence au trafic utilisateur. Chaque
+    vérification retourne un dict contenant au moins "ok" ; seules les
+    vérifications critiques conditionnent la disponibilité.
+
+    Un instantané trop ancien (boucle bloquée ou arrêtée) n'est plus pris pour
+    argent comptant : voir freshness().
+    """
+
+    def __init__(self, refresh_interval: float = 15.0, check_timeout: float = 5.0):
+        self.refresh_interval = refresh_interval
+        self.check_timeout = check_timeout
+        # Trois cycles manqués, en comptant le temps maximal d'un cycle
+        self.max_age = 3 * (refresh_interval + check_timeout)
+        self._checks: List[Tuple[str, Check, bool]] = []
+        self._snapshot: Dict[str, Any] = {"ready": False, "checks": {}, "checked_at": None}
+        self._task = None
+
+    def register(self, name: str, check: Check, critical: bool = True):
+        self._checks.append((name, check, critical))
+
+    async def _run_check(self, check: Check) -> Dict[str, Any]:
+        try:
+            result = check()
+            if asyncio.iscoroutine(result):
+                result = await asyncio.wait_for(result, timeout=self.check_timeout)
+            return result
+        except asyncio.TimeoutError:
+            return {"ok": False, "error": "timeout"}
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+    async def refresh(self) -> Dict[str, Any]:
+        """Exécute toutes les vérifications en parallèle et remplace l'instantané"""
+        results = await asyncio.gather(*(self._run_check(check) for _, check, _ in self._checks))
+        checks = {}
+        ready = True
+        for (name, _, critical), result in zip(self._checks, results):
+            checks[name] = {**result, "critical": critical}
+            if critical and not result.get("ok"):
+                ready = False
+        self._snapshot = {"ready": ready, "checks": checks, "checked_at": time.time()}
+        return self._snapshot
+
+    async def _loop(self):
+        while True:
+            try:
+                snapshot = await self.refresh()
+                if not snapshot["ready"]:
+                    failed = [name for name, check in snapshot["checks"].items() if check["critical"] and not check["ok"]]
+                    logger.warning(f"Service non prêt, vérifications en échec: {', '.join(failed)}")
+            except Exception as e:
+                logger.error(f"Erreur lors du rafraîchissement de l'état de santé: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def freshness(self) -> Dict[str, Any]:
+        """État de la boucle de rafraîchissement, à traiter comme une vérification critique"""
+        checked_at = self._snapshot["checked_at"]
+        age = time.time() - checked_at if checked_at else None
+        running = self._task is not None and not self._task.done()
+        return {
+            "ok": running and age is not None and age <= self.max_age,
+            "loop_running": running,
+            "age_seconds": round(age, 1) if age is not None else None,
+            "max_age_seconds": round(self.max_age, 1)
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = dict(self._snapshot)
+        checked_at = snapshot.pop("checked_at")
+        snapshot["age_seconds"] = round(time.time() - checked_at, 1) if checked_at else None
+        return snapshot
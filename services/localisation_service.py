@@ -1,6 +1,4 @@
 # services/location_service.py
-import pandas as pd
-from thefuzz import process
 import logging
 import os
 
@@ -34,11 +32,23 @@ class LocationService:
             if not os.path.exists(absolute_path):
                  raise FileNotFoundError(f"Fichier non trouvé à l'emplacement: {absolute_path}")
 
-            df = pd.read_excel(absolute_path)
-            if 'Etablissement' not in df.columns:
-                raise KeyError("La colonne 'Etablissement' est introuvable dans le fichier Excel.")
-            
-            self._cache = df['Etablissement'].dropna().tolist()
+            # Import tardif : openpyxl n'est utile qu'au chargement, pandas n'est plus nécessaire
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(absolute_path, read_only=True, data_only=True)
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                header = next(rows, ())
+                if 'Etablissement' not in header:
+                    raise KeyError("La colonne 'Etablissement' est introuvable dans le fichier Excel.")
+                column = header.index('Etablissement')
+                self._cache = [
+                    row[column] for row in rows
+                    if column < len(row) and row[column] is not None
+                ]
+            finally:
+                workbook.close()
+
             logger.info(f"✅ {len(self._cache)} localisations chargées depuis {self.file_path}")
         except FileNotFoundError as e:
             logger.error(f"⚠️ {e}. Le service de localisation sera inactif.")
@@ -50,6 +60,14 @@ class LocationService:
             logger.error(f"⚠️ Une erreur inattendue est survenue lors du chargement des localisations: {e}")
             self._cache = []
 
+    def get_status(self) -> dict:
+        """État de l'index des localisations"""
+        return {
+            "ok": bool(self._cache),
+            "locations": len(self._cache),
+            "file_path": self.file_path
+        }
+
     def find_best_match(self, user_location: str, score_cutoff: int = 80) -> str | None:
         """
         Trouve la meilleure correspondance pour une localisation donnée.
@@ -64,6 +82,8 @@ class LocationService:
         if not user_location or not self._cache:
             return None
 
+        from thefuzz import process
+
         best_match = process.extractOne(user_location, self._cache)
 
         if best_match:
@@ -0,0 +1,23 @@
+# services/metrics.py
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    """Compteurs en mémoire, regroupés par nom puis par libellé (endpoint, raison...)"""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def increment(self, name: str, label: str = "total", value: int = 1):
+        self._counters[name][label] += value
+
+    def get(self, name: str, label: str = "total") -> int:
+        return self._counters.get(name, {}).get(label, 0)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {name: dict(labels) for name, labels in self._counters.items()}
+
+
+# Instance partagée par l'application
+metrics = Metrics()
@@ -3,6 +3,7 @@ import os
 import json
 import httpx
 import asyncio
+import time
 from fastapi import HTTPException
 import logging
 from typing import Optional, List
@@ -10,10 +11,13 @@ from typing import Optional, List
 # --- MODIFIÉ : Import du modèle de message d'historique ---
 # Ce chemin d'import suppose que vos dossiers 'models' et 'services' sont au même niveau.
 from models.schemas import HistoryMessage
+from services.prompt_service import estimate_tokens, conversation_key
+from services.token_usage import TokenAccounting
 
 logger = logging.getLogger(__name__)
 
 MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
+MISTRAL_MODELS_URL = "https://api.mistral.ai/v1/models"
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 MODEL_NAME = os.getenv("MISTRAL_MODEL_NAME", "mistral-large-latest")
 
@@ -22,36 +26,52 @@ MAX_RETRIES = 3
 RETRY_DELAY = 2  # secondes
 BACKOFF_MULTIPLIER = 2
 
-# Modèles disponibles par ordre de préférence
+# Modèles disponibles, du moins cher au plus cher
 MISTRAL_MODELS = [
     "mistral-small-latest",
     "mistral-medium-latest", 
     "mistral-large-latest"
 ]
 
+# Budgets de tokens (0 = désactivé) et plafonds max_tokens par défaut
+MISTRAL_REQUEST_TOKEN_BUDGET = int(os.getenv("MISTRAL_REQUEST_TOKEN_BUDGET", "0"))
+MISTRAL_TOKENS_PER_MINUTE = int(os.getenv("MISTRAL_TOKENS_PER_MINUTE", "0"))
+ANALYZE_MAX_TOKENS = 800
+FOLLOWUP_MAX_TOKENS = 200
+MINIMAL_MAX_TOKENS = 400
+
 class MistralService:
     def __init__(self, prompt_service):
         self.prompt_service = prompt_service
+        self.usage = TokenAccounting(
+            request_budget=MISTRAL_REQUEST_TOKEN_BUDGET,
+            minute_budget=MISTRAL_TOKENS_PER_MINUTE,
+            models=MISTRAL_MODELS
+        )
+        # Derniers en-têtes de limitation reçus et date du dernier 429
+        self.rate_limit_headers = {}
+        self.last_rate_limited = None
         
         if not MISTRAL_API_KEY:
             logger.warning("Clé API Mistral non configurée")
     
     # --- MODIFIÉ : La signature de la méthode utilise maintenant List[HistoryMessage] ---
-    async def analyze_ticket(self, message: str, history: List[HistoryMessage] = None, retry_count: int = 0):
+    async def analyze_ticket(self, message: str, history: List[HistoryMessage] = None, retry_count: int = 0,
+                             examples: Optional[List[dict]] = None):
         """Appel à l'API Mistral pour l'analyse de tickets avec gestion de l'historique structuré."""
         logger.info(f"Appel Mistral API (tentative {retry_count + 1}/{MAX_RETRIES + 1})")
         
         if not MISTRAL_API_KEY:
             raise HTTPException(status_code=500, detail="Clé API Mistral manquante (MISTRAL_API_KEY)")
 
-        current_model = self._get_model_for_retry(retry_count)
-        logger.info(f"Utilisation du modèle: {current_model}")
-
-        system_prompt = (self.prompt_service.get_system_prompt() 
-                        if retry_count <= 1
-                        else self.prompt_service.get_minimal_system_prompt())
+        # Avec des exemples de tickets proches, le prompt minimal suffit
+        system_template = self.prompt_service.serve_template(
+            "base_prompt" if retry_count <= 1 and not examples else "minimal_prompt",
+            routing_key=conversation_key(message, history)
+        )
 
-        messages = [{"role": "system", "content": system_prompt}]
+        messages = [{"role": "system", "content": system_template.render()}]
+        messages.extend(self.prompt_service.build_fewshot_messages(examples))
         
         # --- MODIFIÉ : Logique de traitement de l'historique structuré ---
         if history:
@@ -65,13 +85,18 @@ class MistralService:
             "Content-Type": "application/json"
         }
 
-        temperature = 0.3 + (retry_count * 0.1)
-        max_tokens = 800 if retry_count == 0 else 600
+        # Les retries (429, timeout) ne justifient ni plus de créativité ni un autre plafond :
+        # max_tokens suit les longueurs de sortie observées pour le schéma de ticket
+        max_tokens = self.usage.max_tokens_for("analyze", ANALYZE_MAX_TOKENS)
+        estimated_tokens = system_template.token_count + self._estimate_tokens(messages[1:]) + max_tokens
+
+        current_model = self.usage.select_model(self._get_model_for_retry(retry_count), estimated_tokens)
+        logger.info(f"Utilisation du modèle: {current_model}")
 
         payload = {
             "model": current_model,
             "messages": messages,
-            "temperature": min(temperature, 0.7),
+            "temperature": 0.3,
             "top_p": 0.95,
             "max_tokens": max_tokens
         }
@@ -81,6 +106,7 @@ class MistralService:
             async with httpx.AsyncClient(timeout=60.0) as client:
                 logger.debug(f"Envoi requête avec modèle {current_model}")
                 response = await client.post(MISTRAL_API_URL, headers=headers, json=payload)
+                self._record_rate_limit(response)
                 
                 if response.status_code == 429:
                     # ... gestion des retries ...
@@ -88,11 +114,11 @@ class MistralService:
                         delay = RETRY_DELAY * (BACKOFF_MULTIPLIER ** retry_count)
                         logger.info(f"Attente de {delay}s avant retry...")
                         await asyncio.sleep(delay)
-                        return await self.analyze_ticket(message, history, retry_count + 1)
+                        return await self.analyze_ticket(message, history, retry_count + 1, examples)
                     else:
                         if current_model != "mistral-small-latest":
                             logger.info("Tentative finale avec mistral-small-latest")
-                            return await self._try_with_minimal_model(message, history)
+                            return await self._try_with_minimal_model(message, history, examples)
                         else:
                             raise HTTPException(status_code=429, detail="Limite de capacité Mistral atteinte.")
                 
@@ -105,7 +131,12 @@ class MistralService:
                 if "choices" not in response_data or not response_data["choices"]:
                     raise HTTPException(status_code=502, detail="Réponse invalide de l'API Mistral")
                 
-                content = response_data["choices"][0]["message"]["content"]
+                choice = response_data["choices"][0]
+                self.usage.record(
+                    "analyze", current_model, response_data.get("usage"),
+                    truncated=choice.get("finish_reason") == "length", max_tokens=max_tokens
+                )
+                content = choice["message"]["content"]
                 logger.info(f"Réponse Mistral reçue avec succès (modèle: {current_model})")
                 return content.strip()
                 
@@ -113,14 +144,14 @@ class MistralService:
             logger.error("Timeout lors de l'appel à Mistral API")
             if retry_count < MAX_RETRIES:
                 await asyncio.sleep(RETRY_DELAY)
-                return await self.analyze_ticket(message, history, retry_count + 1)
+                return await self.analyze_ticket(message, history, retry_count + 1, examples)
             raise HTTPException(status_code=504, detail="Timeout de l'API Mistral")
         # ... reste de la gestion d'erreurs ...
         except Exception as e:
             logger.error(f"Erreur inattendue lors de l'appel Mistral: {str(e)}")
             if retry_count < MAX_RETRIES:
                 await asyncio.sleep(RETRY_DELAY)
-                return await self.analyze_ticket(message, history, retry_count + 1)
+                return await self.analyze_ticket(message, history, retry_count + 1, examples)
             raise HTTPException(status_code=502, detail=f"Erreur Mistral: {str(e)}")
 
     # --- MODIFIÉ : La signature de la méthode utilise maintenant List[HistoryMessage] ---
@@ -131,9 +162,11 @@ class MistralService:
         if not MISTRAL_API_KEY:
             raise HTTPException(status_code=500, detail="Clé API Mistral manquante")
 
-        system_prompt = self.prompt_service.get_followup_system_prompt()
+        system_template = self.prompt_service.serve_template(
+            "followup_prompt", routing_key=conversation_key(prompt, history)
+        )
         
-        messages = [{"role": "system", "content": system_prompt}]
+        messages = [{"role": "system", "content": system_template.render()}]
 
         # --- AJOUTÉ : Prise en compte de l'historique pour générer une meilleure question ---
         if history:
@@ -147,34 +180,48 @@ class MistralService:
             "Content-Type": "application/json"
         }
 
+        max_tokens = self.usage.max_tokens_for("followup", FOLLOWUP_MAX_TOKENS)
+        estimated_tokens = system_template.token_count + self._estimate_tokens(messages[1:]) + max_tokens
+        model = self.usage.select_model("mistral-medium-latest", estimated_tokens)
+
         payload = {
-            "model": "mistral-medium-latest",
+            "model": model,
             "messages": messages,
             "temperature": 0.4,
-            "max_tokens": 200
+            "max_tokens": max_tokens
         }
         # ... La logique de try/except reste la même
         try:
             async with httpx.AsyncClient(timeout=30.0) as client:
                 response = await client.post(MISTRAL_API_URL, headers=headers, json=payload)
+                self._record_rate_limit(response)
                 response.raise_for_status()
                 response_data = response.json()
-                content = response_data["choices"][0]["message"]["content"]
+                choice = response_data["choices"][0]
+                self.usage.record(
+                    "followup", model, response_data.get("usage"),
+                    truncated=choice.get("finish_reason") == "length", max_tokens=max_tokens
+                )
+                content = choice["message"]["content"]
                 return content.strip()
         except Exception as e:
             logger.error(f"Erreur lors de la génération de question de suivi: {str(e)}")
             raise HTTPException(status_code=502, detail=f"Erreur Mistral followup: {str(e)}")
 
     # --- MODIFIÉ : La signature de la méthode utilise maintenant List[HistoryMessage] ---
-    async def _try_with_minimal_model(self, message: str, history: List[HistoryMessage] = None):
+    async def _try_with_minimal_model(self, message: str, history: List[HistoryMessage] = None,
+                                      examples: Optional[List[dict]] = None):
         """Tentative avec le modèle le plus économique et des paramètres minimaux."""
         logger.info("Tentative avec paramètres minimaux")
         
         headers = {"Authorization": f"Bearer {MISTRAL_API_KEY}", "Content-Type": "application/json"}
         
-        minimal_prompt = self.prompt_service.get_minimal_system_prompt()
+        minimal_template = self.prompt_service.serve_template(
+            "minimal_prompt", routing_key=conversation_key(message, history)
+        )
         
-        messages = [{"role": "system", "content": minimal_prompt}]
+        messages = [{"role": "system", "content": minimal_template.render()}]
+        messages.extend(self.prompt_service.build_fewshot_messages(examples))
 
         # --- AJOUTÉ : Prise en compte de l'historique même pour le modèle minimal ---
         if history:
@@ -187,15 +234,17 @@ class MistralService:
             "model": "mistral-small-latest",
             "messages": messages,
             "temperature": 0.1,
-            "max_tokens": 400
+            "max_tokens": MINIMAL_MAX_TOKENS
         }
         
         # ... La logique de try/except reste la même
         try:
             async with httpx.AsyncClient(timeout=30.0) as client:
                 response = await client.post(MISTRAL_API_URL, headers=headers, json=payload)
+                self._record_rate_limit(response)
                 if response.status_code == 200:
                     response_data = response.json()
+                    self.usage.record("analyze", "mistral-small-latest", response_data.get("usage"))
                     content = response_data["choices"][0]["message"]["content"]
                     logger.info("Succès avec modèle minimal")
                     return content.strip()
@@ -214,10 +263,51 @@ class MistralService:
         else:
             return "mistral-small-latest"
 
+    def _record_rate_limit(self, response: httpx.Response):
+        """Mémorise les en-têtes de limitation renvoyés par l'API (lecture passive)"""
+        headers = {k.lower(): v for k, v in response.headers.items() if k.lower().startswith("x-ratelimit")}
+        if headers:
+            self.rate_limit_headers = headers
+        if response.status_code == 429:
+            self.last_rate_limited = time.time()
+
+    def rate_limit_status(self, window: float = 60.0) -> dict:
+        """Marge vis-à-vis des limites : pas de 429 récent et budget par minute non dépassé"""
+        recently_limited = self.last_rate_limited is not None and time.time() - self.last_rate_limited < window
+        tokens_last_minute = self.usage.tokens_last_minute()
+        over_budget = bool(MISTRAL_TOKENS_PER_MINUTE) and tokens_last_minute >= MISTRAL_TOKENS_PER_MINUTE
+        return {
+            "ok": not recently_limited and not over_budget,
+            "last_rate_limited": self.last_rate_limited,
+            "tokens_last_minute": tokens_last_minute,
+            "minute_budget": MISTRAL_TOKENS_PER_MINUTE or None,
+            "headers": self.rate_limit_headers
+        }
+
+    async def check_backend(self) -> dict:
+        """Vérifie que l'API Mistral répond (liste des modèles, sans consommation de tokens)"""
+        if not MISTRAL_API_KEY:
+            return {"ok": False, "error": "MISTRAL_API_KEY manquante"}
+        started = time.perf_counter()
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            response = await client.get(MISTRAL_MODELS_URL, headers={"Authorization": f"Bearer {MISTRAL_API_KEY}"})
+        self._record_rate_limit(response)
+        return {
+            "ok": response.status_code == 200,
+            "status_code": response.status_code,
+            "latency_ms": round((time.perf_counter() - started) * 1000)
+        }
+
+    @staticmethod
+    def _estimate_tokens(messages: List[dict]) -> int:
+        """Estimation du nombre de tokens des messages hors prompt système"""
+        return sum(estimate_tokens(msg["content"]) for msg in messages)
+
     def get_status(self):
         """Fonction utilitaire pour vérifier le status de l'API"""
         return {
             "api_key_configured": bool(MISTRAL_API_KEY),
             "model": MODEL_NAME,
-            "fallback_models": MISTRAL_MODELS
+            "fallback_models": MISTRAL_MODELS,
+            "token_usage": self.usage.get_status()
         }
\ No newline at end of file
@@ -1,19 +1,29 @@
 # services/model_service.py
-import requests
+import asyncio
 import json
+import time
+from urllib.parse import urljoin
 from fastapi import HTTPException
 from typing import List, Optional
 from models.schemas import HistoryMessage
+from services.prompt_service import conversation_key
+from services.token_usage import TokenAccounting
+from services.single_flight import SingleFlight, request_key
+from services.metrics import metrics
 import logging
 
 logger = logging.getLogger(__name__)
 
 class ModelService:
-    def __init__(self, backend: str, ollama_url: str, ollama_model: str, prompt_service):
+    def __init__(self, backend: str, ollama_url: str, ollama_model: str, prompt_service, ticket_index=None):
         self.backend = backend
         self.ollama_url = ollama_url
         self.ollama_model = ollama_model
         self.prompt_service = prompt_service
+        # Index optionnel des tickets déjà analysés (services.ticket_index.TicketIndex)
+        self.ticket_index = ticket_index
+        # Les requêtes identiques simultanées partagent un seul appel au modèle
+        self.single_flight = SingleFlight()
         
         # Validation du backend au démarrage
         if backend not in ["mistral", "ollama"]:
@@ -23,40 +33,115 @@ class ModelService:
         if backend == "mistral":
             from .model_mistral import MistralService
             self.mistral_service = MistralService(prompt_service)
+            self.usage = self.mistral_service.usage
+        else:
+            self.usage = TokenAccounting()
         
         logger.info(f"ModelService initialisé avec backend: {backend}")
     
     async def analyze_ticket(self, message: str, history: Optional[List[HistoryMessage]] = None) -> str:
         """Analyse un message et génère un ticket"""
+        return await self.single_flight.run(
+            request_key("analyze", message, history),
+            lambda: self._analyze_ticket(message, history)
+        )
+
+    async def generate_followup(self, prompt: str, history: Optional[List[HistoryMessage]] = None) -> str:
+        """Génère une question de suivi"""
+        return await self.single_flight.run(
+            request_key("followup", prompt, history),
+            lambda: self._generate_followup(prompt, history)
+        )
+
+    def _analysis_prompt_key(self, message: str, history: Optional[List[HistoryMessage]]) -> str:
+        """cache_key du prompt principal servi pour cette conversation"""
+        return self.prompt_service.get_template(
+            "base_prompt", routing_key=conversation_key(message, history)
+        ).cache_key
+
+    async def remember_analysis(self, message: str, history: Optional[List[HistoryMessage]], analysis: dict):
+        """Ajoute une analyse réussie à l'index des tickets, s'il est activé"""
+        if self.ticket_index is None:
+            return
         try:
-            if self.backend == "mistral":
-                return await self.mistral_service.analyze_ticket(message, history)
-            elif self.backend == "ollama":
-                return await self._call_ollama_analyze(message, history)
-            else:
-                raise HTTPException(status_code=400, detail="Backend non supporté")
+            await asyncio.to_thread(
+                self.ticket_index.add, message, history, analysis, self._analysis_prompt_key(message, history)
+            )
+        except Exception as e:
+            logger.warning(f"Impossible d'indexer le ticket: {str(e)}")
+
+    async def _find_similar_tickets(self, message: str, history: Optional[List[HistoryMessage]]):
+        """
+        Retourne (analyse réutilisable, exemples few-shot) d'après l'index des tickets.
+        Un index illisible ne bloque pas l'analyse : on repasse par un appel normal.
+        """
+        if self.ticket_index is None:
+            return None, []
+
+        try:
+            cached, examples = await asyncio.to_thread(
+                self.ticket_index.lookup, message, history, self._analysis_prompt_key(message, history)
+            )
+        except Exception as e:
+            logger.warning(f"Index des tickets inutilisable, analyse sans exemples: {str(e)}")
+            return None, []
+
+        if cached is not None:
+            logger.info("Conversation identique déjà analysée avec ce prompt, réutilisation")
+        return cached, examples
+
+    async def _analyze_ticket(self, message: str, history: Optional[List[HistoryMessage]] = None) -> str:
+        try:
+            cached, examples = await self._find_similar_tickets(message, history)
+            if cached is not None:
+                return json.dumps(cached, ensure_ascii=False)
+
+            with self.usage.request_scope("analyze"):
+                if self.backend == "mistral":
+                    return await self.mistral_service.analyze_ticket(message, history, examples=examples)
+                elif self.backend == "ollama":
+                    return await self._call_ollama_analyze(message, history, examples)
+                else:
+                    raise HTTPException(status_code=400, detail="Backend non supporté")
+        except asyncio.CancelledError:
+            # Plus aucun client n'attend : appel amont et retries abandonnés
+            metrics.increment("upstream_cancelled", "analyze")
+            logger.info("Analyse annulée avant la réponse du modèle")
+            raise
         except Exception as e:
             logger.error(f"Erreur dans analyze_ticket: {str(e)}")
             raise
     
-    async def generate_followup(self, prompt: str, history: Optional[List[HistoryMessage]] = None) -> str:
-        """Génère une question de suivi"""
+    async def _generate_followup(self, prompt: str, history: Optional[List[HistoryMessage]] = None) -> str:
         try:
-            if self.backend == "mistral":
-                return await self.mistral_service.generate_followup(prompt, history)
-            elif self.backend == "ollama":
-                return await self._call_ollama_followup(prompt)
-            else:
-                raise HTTPException(status_code=400, detail="Backend non supporté")
+            with self.usage.request_scope("followup"):
+                if self.backend == "mistral":
+                    return await self.mistral_service.generate_followup(prompt, history)
+                elif self.backend == "ollama":
+                    return await self._call_ollama_followup(prompt, history)
+                else:
+                    raise HTTPException(status_code=400, detail="Backend non supporté")
+        except asyncio.CancelledError:
+            metrics.increment("upstream_cancelled", "followup")
+            logger.info("Génération de la question de suivi annulée")
+            raise
         except Exception as e:
             logger.error(f"Erreur dans generate_followup: {str(e)}")
             raise
     
-    async def _call_ollama_analyze(self, message: str, history: Optional[List[str]] = None) -> str:
+    async def _call_ollama_analyze(self, message: str, history: Optional[List[str]] = None,
+                                   examples: Optional[List[dict]] = None) -> str:
         """Appel à Ollama pour l'analyse"""
         try:
-            # Utilisation du prompt depuis le fichier
-            base_prompt = self.prompt_service.get_system_prompt()
+            # Utilisation du prompt depuis le fichier ; avec des exemples proches, le prompt minimal suffit
+            routing_key = conversation_key(message, history)
+            if examples:
+                base_prompt = self.prompt_service.serve_template("minimal_prompt", routing_key).render()
+                base_prompt += "\n\nExemples:\n" + "\n".join(
+                    msg["content"] for msg in self.prompt_service.build_fewshot_messages(examples)
+                )
+            else:
+                base_prompt = self.prompt_service.serve_template("base_prompt", routing_key).render()
             
             conversation = "\n".join(history + [message]) if history else message
             
@@ -68,16 +153,18 @@ class ModelService:
                 "stream": False
             }
             
-            return await self._make_ollama_request(payload)
+            return await self._make_ollama_request(payload, "analyze")
         except Exception as e:
             logger.error(f"Erreur lors de l'appel Ollama analyze: {str(e)}")
             raise
     
-    async def _call_ollama_followup(self, prompt: str) -> str:
+    async def _call_ollama_followup(self, prompt: str, history: Optional[List[HistoryMessage]] = None) -> str:
         """Appel à Ollama pour le suivi"""
         try:
             # Utilisation du prompt système pour les questions de suivi
-            system_prompt = self.prompt_service.get_followup_system_prompt()
+            system_prompt = self.prompt_service.serve_template(
+                "followup_prompt", routing_key=conversation_key(prompt, history)
+            ).render()
             
             payload = {
                 "model": self.ollama_model,
@@ -87,47 +174,86 @@ class ModelService:
                 "stream": False
             }
             
-            return await self._make_ollama_request(payload)
+            return await self._make_ollama_request(payload, "followup")
         except Exception as e:
             logger.error(f"Erreur lors de l'appel Ollama followup: {str(e)}")
             raise
     
-    async def _make_ollama_request(self, payload: dict) -> str:
-        """Effectue la requête HTTP vers Ollama"""
+    async def _make_ollama_request(self, payload: dict, endpoint: str) -> str:
+        """Effectue la requête HTTP vers Ollama (asynchrone, donc annulable)"""
+        import httpx
+
         try:
-            response = requests.post(
-                self.ollama_url, 
-                json=payload, 
-                timeout=30,
-                headers={"Content-Type": "application/json"}
-            )
-            response.raise_for_status()
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                response = await client.post(
+                    self.ollama_url, 
+                    json=payload, 
+                    headers={"Content-Type": "application/json"}
+                )
+                response.raise_for_status()
             
             result = response.json()
+            # Ollama expose les compteurs sous prompt_eval_count / eval_count
+            self.usage.record(endpoint, self.ollama_model, {
+                "prompt_tokens": result.get("prompt_eval_count"),
+                "completion_tokens": result.get("eval_count")
+            })
             return result.get("response", "").strip()
             
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             logger.error("Timeout lors de l'appel à Ollama")
             raise HTTPException(status_code=504, detail="Timeout du service Ollama")
-        except requests.exceptions.ConnectionError:
+        except httpx.ConnectError:
             logger.error("Impossible de se connecter à Ollama")
             raise HTTPException(status_code=502, detail="Service Ollama indisponible")
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             logger.error(f"Erreur HTTP Ollama: {e}")
             raise HTTPException(status_code=502, detail=f"Erreur Ollama: {e}")
         except Exception as e:
             logger.error(f"Erreur inattendue Ollama: {e}")
             raise HTTPException(status_code=502, detail=f"Erreur Ollama: {e}")
     
+    async def check_backend(self) -> dict:
+        """Vérifie que le backend configuré est joignable (appelé hors du chemin des requêtes)"""
+        if self.backend == "mistral":
+            return await self.mistral_service.check_backend()
+
+        # Import tardif : httpx n'est chargé que lorsqu'un appel est réellement fait
+        import httpx
+
+        # /api/tags liste les modèles installés sans lancer de génération
+        started = time.perf_counter()
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            response = await client.get(urljoin(self.ollama_url, "/api/tags"))
+        models = [m.get("name", "") for m in response.json().get("models", [])] if response.status_code == 200 else []
+        # "mistral" désigne implicitement "mistral:latest"
+        installed = any(name == self.ollama_model or name.split(":")[0] == self.ollama_model for name in models)
+        return {
+            "ok": response.status_code == 200 and installed,
+            "status_code": response.status_code,
+            "model_installed": installed,
+            "latency_ms": round((time.perf_counter() - started) * 1000)
+        }
+
+    def rate_limit_status(self) -> dict:
+        """Marge vis-à-vis des limites du fournisseur (sans appel réseau)"""
+        if self.backend == "mistral":
+            return self.mistral_service.rate_limit_status()
+        return {"ok": True, "tokens_last_minute": self.usage.tokens_last_minute()}
+
     def get_status(self):
         """Retourne le statut du service"""
         status = {
             "backend": self.backend,
             "ollama_url": self.ollama_url if self.backend == "ollama" else None,
-            "ollama_model": self.ollama_model if self.backend == "ollama" else None
+            "ollama_model": self.ollama_model if self.backend == "ollama" else None,
+            "single_flight": self.single_flight.get_status(),
+            "ticket_index": self.ticket_index.get_status() if self.ticket_index is not None else None
         }
         
         if self.backend == "mistral" and hasattr(self, 'mistral_service'):
             status.update(self.mistral_service.get_status())
+        else:
+            status["token_usage"] = self.usage.get_status()
         
         return status
\ No newline at end of file
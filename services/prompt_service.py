@@ -1,62 +1,241 @@
 # services/prompt_service.py
 from typing import Dict, Any, List, Optional
+from string import Template
+import hashlib
+import json
 import os
+import re
+import time
+import zlib
 import logging
 
+from services.metrics import metrics
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_VARIANT = "default"
+
+# Approximation du nombre de tokens : mots, nombres et signes de ponctuation isolés.
+# Suffisant pour dimensionner max_tokens et comparer les prompts entre eux.
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+# Valeurs d'exemple utilisées par le benchmark de rendu
+_SAMPLE_TICKET = {
+    "Title": "Imprimante hors service",
+    "Category": "INCIDENT",
+    "Priority": "[INCONNU]",
+    "Localisation": "[INCONNU]",
+    "Description": "L'imprimante du bureau ne répond plus depuis ce matin",
+    "Frustration": 3
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estime le nombre de tokens d'un texte"""
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def conversation_key(message: str, history: Optional[List[Any]] = None) -> str:
+    """
+    Clé de routage A/B stable sur toute une conversation : le premier message
+    utilisateur de l'historique, ou le message courant s'il n'y en a pas.
+    """
+    for msg in history or []:
+        if msg.role == "user":
+            return msg.content
+    return message
+
+
+class PromptTemplate:
+    """Prompt chargé en mémoire, précompilé et identifié par son contenu"""
+
+    __slots__ = ("name", "variant", "text", "template", "content_hash", "version", "token_count")
+
+    def __init__(self, name: str, variant: str, text: str, version: int = 1):
+        self.name = name
+        self.variant = variant
+        self.text = text
+        self.template = Template(text)
+        self.content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self.version = version
+        self.token_count = estimate_tokens(text)
+
+    @property
+    def cache_key(self) -> str:
+        """Clé stable à utiliser par les caches en aval"""
+        return f"{self.name}:{self.variant}:v{self.version}:{self.content_hash[:12]}"
+
+    def render(self, **values: Any) -> str:
+        """Rend le prompt ; sans variables, retourne directement le texte"""
+        if not values:
+            return self.text
+        return self.template.safe_substitute(**values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "variant": self.variant,
+            "version": self.version,
+            "content_hash": self.content_hash,
+            "cache_key": self.cache_key,
+            "token_count": self.token_count,
+        }
+
+
 class PromptService:
     def __init__(self):
         self.prompts_dir = os.path.join(os.path.dirname(__file__), "../prompts")
-        self._cache = {}  # Cache pour éviter de relire les fichiers à chaque fois
-        
-    def load_prompt(self, name: str) -> str:
-        """Charge un prompt depuis un fichier txt avec cache"""
-        if name in self._cache:
-            return self._cache[name]
-            
-        try:
-            path = os.path.join(self.prompts_dir, f"{name}.txt")
+        # Registre {nom: {variante: PromptTemplate}}, remplacé en bloc à chaque rechargement
+        self._registry: Dict[str, Dict[str, PromptTemplate]] = {}
+        self.reload()
+
+    def _read_templates(self) -> Dict[str, Dict[str, PromptTemplate]]:
+        """Lit tous les fichiers de prompts (<nom>.txt et <nom>.<variante>.txt)"""
+        registry: Dict[str, Dict[str, PromptTemplate]] = {}
+        for filename in sorted(os.listdir(self.prompts_dir)):
+            if not filename.endswith(".txt"):
+                continue
+            stem = filename[:-len(".txt")]
+            name, _, variant = stem.partition(".")
+            variant = variant or DEFAULT_VARIANT
+
+            path = os.path.join(self.prompts_dir, filename)
             with open(path, "r", encoding="utf-8") as f:
                 content = f.read().strip()
-                self._cache[name] = content
-                return content
-        except FileNotFoundError:
-            logger.error(f"Fichier prompt non trouvé: {name}.txt")
-            raise FileNotFoundError(f"Prompt '{name}' non trouvé")
+
+            template = PromptTemplate(name, variant, content)
+
+            # La version n'est incrémentée que si le contenu a changé
+            previous = self._registry.get(name, {}).get(variant)
+            if previous is not None:
+                same_content = previous.content_hash == template.content_hash
+                template.version = previous.version if same_content else previous.version + 1
+
+            registry.setdefault(name, {})[variant] = template
+        return registry
+
+    def reload(self) -> Dict[str, Dict[str, PromptTemplate]]:
+        """Recharge tous les prompts ; le registre n'est remplacé qu'en cas de succès"""
+        try:
+            registry = self._read_templates()
         except Exception as e:
-            logger.error(f"Erreur lors du chargement du prompt {name}: {str(e)}")
+            logger.error(f"Erreur lors du rechargement des prompts: {str(e)}")
             raise
-    
-    def get_system_prompt(self) -> str:
-        """Récupère le prompt système principal"""
-        return self.load_prompt("base_prompt")
-    
-    def get_minimal_system_prompt(self) -> str:
-        """Récupère le prompt système minimal pour les retry"""
-        return self.load_prompt("minimal_prompt")
-    
-    def get_followup_system_prompt(self) -> str:
-        """Récupère le prompt système pour les questions de suivi"""
-        return self.load_prompt("followup_prompt")
-    
-    def build_followup_prompt(self, ticket: Dict[str, Any], history: Optional[List[str]] = None) -> str:
-        """Construit le prompt complet pour les questions de suivi"""
-        
-        history_str = "\n".join([f"{msg.role}: {msg.content}" for msg in history]) if history else "Aucun historique."
-        
-        # Formatage propre du ticket
-        ticket_str = "\n".join([f"{k}: {v}" for k, v in ticket.items()])
-        
-        followup_prompt = self.get_followup_system_prompt
-
-        return (
-            f"{followup_prompt}\n"
-            f"Historique de la conversation:\n{history_str}\n\n"
-            f"Ticket actuel:\n{ticket_str}\n\n"
-        )
-    
+        self._registry = registry
+        logger.info(f"{sum(len(v) for v in registry.values())} prompts chargés depuis {self.prompts_dir}")
+        return registry
+
+    def get_template(self, name: str, variant: Optional[str] = None, routing_key: Optional[str] = None) -> PromptTemplate:
+        """
+        Retourne le prompt précompilé demandé.
+
+        Si aucune variante n'est imposée et qu'une clé de routage est fournie,
+        la variante est choisie de façon déterministe parmi celles disponibles (A/B).
+        """
+        variants = self._registry.get(name)
+        if not variants:
+            logger.error(f"Fichier prompt non trouvé: {name}.txt")
+            raise FileNotFoundError(f"Prompt '{name}' non trouvé")
+
+        if variant is None:
+            if routing_key is not None and len(variants) > 1:
+                keys = sorted(variants)
+                variant = keys[zlib.crc32(routing_key.encode("utf-8")) % len(keys)]
+            else:
+                variant = DEFAULT_VARIANT
+
+        # Sans fichier par défaut, la première variante (ordre alphabétique) en tient lieu
+        return variants.get(variant) or variants.get(DEFAULT_VARIANT) or variants[min(variants)]
+
+    def serve_template(self, name: str, routing_key: Optional[str] = None) -> PromptTemplate:
+        """
+        Sélectionne le prompt envoyé au modèle et trace la variante servie
+        (clé de cache comptée dans les métriques) pour attribuer les résultats A/B.
+        """
+        template = self.get_template(name, routing_key=routing_key)
+        metrics.increment("prompt_served", template.cache_key)
+        logger.info(f"Prompt servi: {template.cache_key}")
+        return template
+
+    def build_followup_prompt(self, ticket: Dict[str, Any], history: Optional[List[Any]] = None) -> str:
+        """
+        Construit le message utilisateur pour les questions de suivi (prompts/followup_user.txt).
+        Le prompt système de suivi est envoyé séparément par les backends.
+        """
+        return self.get_template("followup_user").render(**followup_values(ticket, history))
+
+    def build_fewshot_messages(self, examples: Optional[List[Dict[str, Any]]]) -> List[Dict[str, str]]:
+        """Exemples (conversation indexée, analyse) sous forme de paires user/assistant compactes"""
+        messages = []
+        for example in examples or []:
+            messages.append({"role": "user", "content": example["conversation"]})
+            messages.append({
+                "role": "assistant",
+                "content": json.dumps(example["analysis"], ensure_ascii=False, separators=(",", ":"))
+            })
+        return messages
+
+    def is_loaded(self, name: str) -> bool:
+        """Indique si un prompt est présent dans le registre"""
+        return bool(self._registry.get(name))
+
+    def describe(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Métadonnées de tous les prompts chargés (version, hash, tokens)"""
+        return {
+            name: [template.to_dict() for template in variants.values()]
+            for name, variants in self._registry.items()
+        }
+
     def invalidate_cache(self):
-        """Vide le cache des prompts (utile pour le développement)"""
-        self._cache.clear()
-        logger.info("Cache des prompts vidé")
\ No newline at end of file
+        """Recharge les prompts depuis le disque (utile pour le développement)"""
+        self.reload()
+        logger.info("Cache des prompts rechargé")
+
+
+def followup_values(ticket: Dict[str, Any], history: Optional[List[Any]] = None) -> Dict[str, str]:
+    """Variables du gabarit followup_user : historique et ticket mis à plat"""
+    history_str = "\n".join([f"{msg.role}: {msg.content}" for msg in history]) if history else "Aucun historique."
+    ticket_str = "\n".join([f"{k}: {v}" for k, v in ticket.items()])
+    return {"history": history_str, "ticket": ticket_str}
+
+
+def _benchmark(iterations: int = 2000) -> Dict[str, float]:
+    """Temps moyen de rendu de chaque prompt du registre (toutes variantes), en microsecondes"""
+    from models.schemas import HistoryMessage
+
+    service = PromptService()
+
+    def history(size: int) -> List[HistoryMessage]:
+        return [
+            HistoryMessage(role="user" if i % 2 == 0 else "assistant", content=f"Message numéro {i} " * 8)
+            for i in range(size)
+        ]
+
+    def timeit(fn) -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    # Les variables sont préparées hors chronométrage : seul render() est mesuré
+    cases = {
+        "typical": followup_values(_SAMPLE_TICKET, history(4)),
+        "long_history": followup_values(_SAMPLE_TICKET, history(200)),
+    }
+    results = {}
+    for variants in service._registry.values():
+        for template in variants.values():
+            label = template.cache_key.rsplit(":", 1)[0]
+            if not template.template.get_identifiers():
+                # Prompt statique : rendu sans variables, comme dans les backends
+                results[label] = timeit(template.render)
+                continue
+            for case, values in cases.items():
+                results[f"{label}:{case}"] = timeit(lambda: template.render(**values))
+    return results
+
+
+if __name__ == "__main__":
+    # python -m services.prompt_service
+    for case, timing in _benchmark().items():
+        print(f"{case:<45} {timing:8.2f}µs")
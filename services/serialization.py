@@ -0,0 +1,119 @@
+# services/serialization.py
+from typing import Any, Dict, Optional
+import logging
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter, ValidationError
+
+from models.schemas import TicketResponse
+
+logger = logging.getLogger(__name__)
+
+# Construit une seule fois : le schéma de validation est compilé à l'import
+TICKET_ADAPTER = TypeAdapter(TicketResponse)
+
+
+def parse_ticket(raw: str) -> Any:
+    """
+    Parse et valide en une passe la réponse JSON du modèle contre TicketResponse.
+    Les clés hors schéma (codes demandés par le prompt, etc.) sont conservées et
+    [INCONNU] est accepté pour les champs encore inconnus.
+
+    Si le JSON est valide mais ne respecte pas le schéma (ex. catégorie inventée,
+    frustration hors 1-5), le contenu brut est retourné tel quel comme auparavant.
+
+    Raises:
+        json.JSONDecodeError: si la réponse n'est pas un JSON valide.
+    """
+    try:
+        ticket = TICKET_ADAPTER.validate_json(raw)
+        return ticket.model_dump(mode="json", by_alias=True)
+    except ValidationError as e:
+        logger.debug(f"Ticket hors schéma, retour du JSON brut: {e.error_count()} erreur(s)")
+    # orjson.JSONDecodeError hérite de json.JSONDecodeError
+    return orjson.loads(raw)
+
+
+def api_response(
+    success: bool,
+    message: str,
+    data: Any = None,
+    error: Optional[str] = None,
+    followup_token: Optional[str] = None,
+    status_code: int = 200
+) -> ORJSONResponse:
+    """
+    Construit directement la réponse au format ApiResponse.
+
+    Retourner une Response court-circuite la revalidation par response_model,
+    qui reste déclaré sur les routes pour la documentation OpenAPI.
+    """
+    return ORJSONResponse(
+        status_code=status_code,
+        content={
+            "success": success,
+            "data": data,
+            "message": message,
+            "error": error,
+            "followup_token": followup_token
+        }
+    )
+
+
+def _benchmark(iterations: int = 2000) -> Dict[str, Dict[str, float]]:
+    """Compare l'ancien chemin (json + double validation) au chemin rapide, en microsecondes"""
+    import json
+    import time
+    from fastapi.encoders import jsonable_encoder
+    from models.schemas import ApiResponse, TicketInput
+
+    raw_ticket = json.dumps({
+        "Title": "Imprimante hors service",
+        "Category": "INCIDENT",
+        "Priority": "MOYENNE",
+        "Localisation": "Bureau 204",
+        "Description": "L'imprimante du bureau ne répond plus depuis ce matin",
+        "Frustration": 3
+    }, ensure_ascii=False)
+
+    def history(size: int):
+        return [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"Message numéro {i} " * 8}
+            for i in range(size)
+        ]
+
+    payloads = {
+        "typical": {"message": "Mon imprimante ne fonctionne plus", "history": history(2)},
+        "long_history": {"message": "Mon imprimante ne fonctionne plus", "history": history(200)},
+    }
+
+    def timeit(fn) -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    def legacy_output():
+        data = json.loads(raw_ticket)
+        response = ApiResponse(success=True, data=data, message="ok")
+        validated = ApiResponse.model_validate(response.model_dump())
+        return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+    def fast_output():
+        return api_response(True, "ok", data=parse_ticket(raw_ticket)).body
+
+    results = {"output": {"legacy": timeit(legacy_output), "fast": timeit(fast_output)}}
+    for name, payload in payloads.items():
+        body = json.dumps(payload)
+        results[f"input_{name}"] = {
+            "legacy": timeit(lambda: TicketInput.model_validate(json.loads(body))),
+            "fast": timeit(lambda: TicketInput.model_validate_json(body)),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    # python -m services.serialization
+    for case, timings in _benchmark().items():
+        print(f"{case:<20} " + "  ".join(f"{k}={v:8.2f}µs" for k, v in timings.items()))
@@ -0,0 +1,71 @@
+# services/single_flight.py
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from models.schemas import HistoryMessage
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(kind: str, content: str, history: Optional[List[HistoryMessage]] = None) -> str:
+    """Clé identifiant une requête au modèle : même type, même contenu, même historique"""
+    payload = [kind, content, [(msg.role, msg.content) for msg in history or []]]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Regroupe les appels identiques simultanés sur un seul appel amont.
+
+    L'appel amont tourne dans sa propre tâche : l'annulation d'un appelant
+    (client déconnecté) ne l'interrompt pas tant qu'un autre appelant l'attend.
+    Lorsque le dernier appelant abandonne, l'appel amont est annulé.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.coalesced = 0
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(factory()))
+            call.task.add_done_callback(lambda task, key=key, call=call: self._forget(key, call))
+            self._calls[key] = call
+        else:
+            self.coalesced += 1
+            logger.info("Requête identique déjà en cours, résultat partagé")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Plus personne n'attend : on libère la clé et on annule l'appel amont
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Évite les avertissements "Task exception was never retrieved"
+        if call.task.done() and not call.task.cancelled():
+            call.task.exception()
+
+    def get_status(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "coalesced": self.coalesced
+        }
@@ -0,0 +1,205 @@
+# services/ticket_index.py
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models.schemas import HistoryMessage
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = 1024
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def conversation_text(message: str, history: Optional[List[HistoryMessage]] = None) -> str:
+    """Texte vectorisé pour une analyse : messages utilisateur de l'historique puis le message courant"""
+    turns = [msg.content for msg in history or [] if msg.role == "user"]
+    turns.append(message)
+    return "\n".join(turns)
+
+
+def normalize_text(text: str) -> str:
+    """Minuscules, sans accents, espaces compactés"""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    normalized = "".join(c for c in normalized if not unicodedata.combining(c))
+    return " ".join(normalized.split())
+
+
+def conversation_hash(message: str, history: Optional[List[HistoryMessage]] = None) -> str:
+    """
+    Empreinte de la conversation complète (rôles et contenus normalisés, réponses
+    de l'assistant comprises), seule base de la réutilisation directe d'une analyse
+    """
+    turns = [(msg.role, normalize_text(msg.content)) for msg in history or []]
+    turns.append(("user", normalize_text(message)))
+    return hashlib.sha256(json.dumps(turns, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def vectorize(text: str) -> np.ndarray:
+    """
+    Vecteur normalisé de n-grammes hachés (mots + trigrammes de caractères).
+
+    crc32 est utilisé plutôt que hash() pour que les vecteurs restent stables
+    d'un processus à l'autre.
+    """
+    normalized = normalize_text(text)
+
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for word in _WORD_PATTERN.findall(normalized):
+        grams = [word]
+        padded = f" {word} "
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        for gram in grams:
+            h = zlib.crc32(gram.encode("utf-8"))
+            vector[h % DIMENSIONS] += 1.0 if h & 0x80000000 else -1.0
+
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+class TicketIndex:
+    """
+    Index local des tickets déjà analysés.
+
+    Les vecteurs sont stockés bruts (float32) dans `vectors.f32`, lu en
+    memory-map ; le texte vectorisé et l'analyse associée sont ajoutés ligne par
+    ligne dans `tickets.jsonl`. L'index grossit au fil des analyses réussies.
+
+    Une analyse n'est réutilisée telle quelle que si toute la conversation est
+    identique (voir conversation_hash) ; la similarité vectorielle ne sert qu'à
+    choisir des exemples few-shot. Chaque entrée porte la cache_key du prompt
+    qui l'a produite et les entrées d'un autre prompt (autre version ou
+    variante) sont ignorées.
+    """
+
+    def __init__(self, directory: str, fewshot_threshold: float = 0.6):
+        self.directory = directory
+        self.fewshot_threshold = fewshot_threshold
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.entries_path = os.path.join(directory, "tickets.jsonl")
+        self._entries: List[Dict[str, Any]] = []
+        # (empreinte de la conversation, cache_key du prompt) -> position dans l'index
+        self._exact: Dict[Tuple[str, str], int] = {}
+        # cache_key du prompt -> positions de ses entrées, pour ne comparer que celles-ci
+        self._rows: Dict[str, List[int]] = {}
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.fewshot = 0
+        self.load()
+
+    def load(self):
+        """Charge les métadonnées et mappe les vecteurs existants"""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        if os.path.exists(self.entries_path):
+            with open(self.entries_path, "r", encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+
+        row_bytes = DIMENSIONS * np.dtype(np.float32).itemsize
+        stored_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        # Une écriture interrompue peut laisser un fichier plus long que l'autre
+        count = min(len(entries), stored_rows)
+        self._entries = entries[:count]
+        self._exact = {}
+        self._rows = {}
+        for i, entry in enumerate(self._entries):
+            # Les entrées d'un format antérieur restent en place (alignement des
+            # vecteurs) mais ne sont plus jamais proposées
+            if "conversation_hash" not in entry or "prompt_key" not in entry:
+                continue
+            self._exact[(entry["conversation_hash"], entry["prompt_key"])] = i
+            self._rows.setdefault(entry["prompt_key"], []).append(i)
+        self._remap(count)
+        logger.info(f"Index de tickets: {count} tickets chargés depuis {self.directory}")
+
+    def _remap(self, count: int):
+        if count:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, DIMENSIONS))
+        else:
+            self._vectors = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, message: str, history: Optional[List[HistoryMessage]], prompt_key: str,
+               k: int = 2) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Retourne (analyse réutilisable, exemples few-shot) pour une conversation.
+
+        L'analyse n'est retournée qu'en cas de conversation identique après
+        normalisation ; sinon jusqu'à k tickets proches au-delà de
+        fewshot_threshold servent d'exemples.
+        """
+        position = self._exact.get((conversation_hash(message, history), prompt_key))
+        if position is not None:
+            self.reused += 1
+            return self._entries[position]["analysis"], []
+
+        examples = [
+            entry for score, entry in self.search(conversation_text(message, history), prompt_key, k)
+            if score >= self.fewshot_threshold
+        ]
+        if examples:
+            self.fewshot += 1
+        return None, examples
+
+    def search(self, text: str, prompt_key: str, k: int = 2) -> List[Tuple[float, Dict[str, Any]]]:
+        """Retourne les k tickets les plus proches produits par ce prompt, avec leur similarité cosinus"""
+        # Positions lues avant les vecteurs : add() remappe avant de publier une position
+        rows = np.array(self._rows.get(prompt_key, ()), dtype=np.intp)
+        vectors, entries = self._vectors, self._entries
+        if vectors is None or not len(rows):
+            return []
+        scores = vectors[rows] @ vectorize(text)
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(float(scores[i]), entries[rows[i]]) for i in best]
+
+    def add(self, message: str, history: Optional[List[HistoryMessage]], analysis: Dict[str, Any],
+            prompt_key: str) -> bool:
+        """Ajoute une analyse à l'index, sauf si la même conversation y figure déjà pour ce prompt"""
+        key = (conversation_hash(message, history), prompt_key)
+        text = conversation_text(message, history)
+        query = vectorize(text)
+        with self._lock:
+            if key in self._exact:
+                return False
+
+            # Le texte vectorisé sert aussi de message utilisateur de l'exemple few-shot
+            entry = {
+                "conversation": text,
+                "analysis": analysis,
+                "conversation_hash": key[0],
+                "prompt_key": prompt_key
+            }
+            with open(self.vectors_path, "ab") as f:
+                f.write(query.astype(np.float32).tobytes())
+            with open(self.entries_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+            position = len(self._entries)
+            self._remap(position + 1)
+            self._entries.append(entry)
+            self._exact[key] = position
+            self._rows.setdefault(prompt_key, []).append(position)
+        return True
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "tickets": len(self),
+            "fewshot_threshold": self.fewshot_threshold,
+            "reused": self.reused,
+            "fewshot": self.fewshot
+        }
@@ -0,0 +1,149 @@
+# services/token_usage.py
+import logging
+import math
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Consommation de la requête HTTP en cours (cumule les retries et fallbacks)
+_request_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("request_usage", default=None)
+
+
+def _empty_usage() -> Dict[str, int]:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+
+class TokenAccounting:
+    """
+    Comptabilise les tokens consommés par endpoint et par modèle, ajuste les
+    plafonds max_tokens d'après les longueurs de sortie observées et applique
+    un budget de tokens par requête et par minute.
+    """
+
+    # Nombre minimal d'observations avant d'adapter max_tokens
+    MIN_SAMPLES = 20
+    # Marge appliquée au 95e percentile des sorties observées
+    HEADROOM = 1.5
+    # Au-delà de cette fraction du budget, on descend d'un cran de modèle
+    PRESSURE_THRESHOLD = 0.8
+
+    def __init__(self, request_budget: int = 0, minute_budget: int = 0,
+                 models: Optional[List[str]] = None, window_size: int = 200):
+        self.request_budget = request_budget
+        self.minute_budget = minute_budget
+        # Modèles du moins cher au plus cher
+        self.models = models or []
+        self.by_endpoint: Dict[str, Dict[str, int]] = defaultdict(_empty_usage)
+        self.by_model: Dict[str, Dict[str, int]] = defaultdict(_empty_usage)
+        self._outputs: Dict[str, Deque[int]] = defaultdict(lambda: deque(maxlen=window_size))
+        self._minute: Deque[Tuple[float, int]] = deque()
+        # Dernier plafond max_tokens effectivement appliqué, par endpoint
+        self._applied_caps: Dict[str, int] = {}
+        self.downgrades = 0
+
+    @contextmanager
+    def request_scope(self, endpoint: str):
+        """Isole la consommation d'un appel de service et la journalise à la fin"""
+        usage = _empty_usage()
+        token = _request_usage.set(usage)
+        try:
+            yield usage
+        finally:
+            _request_usage.reset(token)
+            if usage["calls"]:
+                logger.info(
+                    f"Tokens consommés ({endpoint}): {usage['prompt_tokens']} entrée, "
+                    f"{usage['completion_tokens']} sortie, {usage['calls']} appel(s)"
+                )
+
+    def record(self, endpoint: str, model: str, usage: Optional[Dict[str, Any]],
+               truncated: bool = False, max_tokens: Optional[int] = None):
+        """Enregistre le bloc `usage` d'une réponse du fournisseur"""
+        if not usage:
+            return
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        total_tokens = int(usage.get("total_tokens") or prompt_tokens + completion_tokens)
+
+        targets = [self.by_endpoint[endpoint], self.by_model[model]]
+        current = _request_usage.get()
+        if current is not None:
+            targets.append(current)
+        for target in targets:
+            target["calls"] += 1
+            target["prompt_tokens"] += prompt_tokens
+            target["completion_tokens"] += completion_tokens
+            target["total_tokens"] += total_tokens
+
+        # Une sortie tronquée signifie que le plafond était trop bas : on la surpondère
+        observed = completion_tokens
+        if truncated and max_tokens:
+            observed = max(completion_tokens, max_tokens) * 2
+        if observed:
+            self._outputs[endpoint].append(observed)
+
+        self._minute.append((time.monotonic(), total_tokens))
+
+    def max_tokens_for(self, endpoint: str, default: int, floor: int = 64) -> int:
+        """Plafond max_tokens adapté aux sorties observées, borné par la valeur par défaut"""
+        outputs = self._outputs.get(endpoint)
+        if not outputs or len(outputs) < self.MIN_SAMPLES:
+            cap = default
+        else:
+            ordered = sorted(outputs)
+            p95 = ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+            cap = max(floor, min(default, int(p95 * self.HEADROOM)))
+        self._applied_caps[endpoint] = cap
+        return cap
+
+    def tokens_last_minute(self) -> int:
+        cutoff = time.monotonic() - 60
+        while self._minute and self._minute[0][0] < cutoff:
+            self._minute.popleft()
+        return sum(tokens for _, tokens in self._minute)
+
+    def select_model(self, preferred: str, estimated_tokens: int) -> str:
+        """
+        Choisit le modèle en fonction de la pression sur les budgets.
+
+        Au-delà de PRESSURE_THRESHOLD, le modèle descend d'un cran dans la liste ;
+        si un budget serait dépassé, le modèle le moins cher est utilisé. Le budget
+        par requête compte aussi ce qu'ont déjà consommé les retries et fallbacks.
+        """
+        if preferred not in self.models:
+            return preferred
+
+        pressure = 0.0
+        if self.request_budget:
+            current = _request_usage.get()
+            spent = current["total_tokens"] if current is not None else 0
+            pressure = max(pressure, (spent + estimated_tokens) / self.request_budget)
+        if self.minute_budget:
+            pressure = max(pressure, (self.tokens_last_minute() + estimated_tokens) / self.minute_budget)
+
+        index = self.models.index(preferred)
+        if pressure >= 1:
+            index = 0
+        elif pressure >= self.PRESSURE_THRESHOLD:
+            index = max(0, index - 1)
+
+        selected = self.models[index]
+        if selected != preferred:
+            self.downgrades += 1
+            logger.info(f"Budget de tokens sous pression ({pressure:.0%}), modèle {preferred} -> {selected}")
+        return selected
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "by_endpoint": dict(self.by_endpoint),
+            "by_model": dict(self.by_model),
+            "tokens_last_minute": self.tokens_last_minute(),
+            "request_budget": self.request_budget or None,
+            "minute_budget": self.minute_budget or None,
+            "max_tokens": dict(self._applied_caps),
+            "model_downgrades": self.downgrades
+        }
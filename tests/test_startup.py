@@ -0,0 +1,25 @@
+# tests/test_startup.py
+import json
+import os
+import subprocess
+import sys
+
+from profile_startup import DEFAULT_BUDGET_MS, PROJECT_ROOT, measure_startup
+
+# Modules lourds qui ne doivent pas être chargés par le simple import de main
+LAZY_MODULES = ["httpx", "openpyxl", "thefuzz", "numpy"]
+
+
+def test_startup_within_budget():
+    budget_ms = float(os.getenv("STARTUP_BUDGET_MS", DEFAULT_BUDGET_MS))
+    timings = measure_startup()
+    assert timings["total_ms"] <= budget_ms, timings
+
+
+def test_heavy_modules_are_lazy():
+    snippet = f"import json, sys, main; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    output = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    assert json.loads(output.strip().splitlines()[-1]) == []